@@ -2,33 +2,93 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 # --------------------------------------------------------------------------
+import hashlib
+import inspect
 import logging
+import queue
+import shutil
+import sys
 import tempfile
+import threading
+from collections import OrderedDict
 from copy import deepcopy
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Callable, Dict, Union
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
 
+import numpy as np
 import onnx
+from onnx.external_data_helper import (
+    ExternalDataInfo,
+    _get_all_tensors,
+    _get_attribute_tensors,
+    load_external_data_for_tensor,
+    uses_external_data,
+)
 from packaging import version
 
 from olive.cache import get_local_path_from_root
 from olive.common.config_utils import validate_config
-from olive.common.utils import hash_string
+from olive.common.utils import hash_dict, hash_string
 from olive.data.config import DataConfig
 from olive.exception import OlivePassError
 from olive.hardware.accelerator import AcceleratorSpec
 from olive.model import ONNXModelHandler
 from olive.model.utils import resolve_onnx_path
 from olive.passes import Pass
-from olive.passes.onnx.common import get_external_data_config, model_proto_to_file, model_proto_to_olive_model
+from olive.passes.onnx.common import get_external_data_config, model_proto_to_olive_model
 from olive.passes.pass_config import ParamCategory, PassConfigParam
-from olive.resource_path import OLIVE_RESOURCE_ANNOTATIONS, LocalFile
+from olive.resource_path import OLIVE_RESOURCE_ANNOTATIONS, LocalFile, LocalFolder
 from olive.strategy.search_parameter import Boolean, Categorical, Conditional, ConditionalDefault
 
 logger = logging.getLogger(__name__)
 
 # pylint: disable=consider-using-with
 
+# onnxruntime is an optional dependency of olive, import it once here instead of in every pass run
+try:
+    from onnxruntime import __version__ as OrtVersion
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+    from onnxruntime.quantization.calibrate import CalibrationMethod
+
+    _ORT_VERSION = version.parse(OrtVersion)
+    # quantize_static can cache the calibrated tensor ranges in newer versions of onnxruntime
+    _ORT_SUPPORTS_CALIBRATION_CACHE = "calibration_cache_path" in inspect.signature(quantize_static).parameters
+    # 16-bit quantization types are only available in newer versions of onnxruntime
+    _ORT_HAS_INT16 = hasattr(QuantType, "QInt16")
+except ImportError:
+    # keep the module importable without onnxruntime, the passes raise ImportError when they are run
+    # placeholder base class of the calibration data readers defined in this module
+    CalibrationDataReader = object
+    _ORT_VERSION = None
+    _ORT_SUPPORTS_CALIBRATION_CACHE = False
+    _ORT_HAS_INT16 = False
+
+_ORT_VER_1_16_0 = version.parse("1.16.0")
+_ORT_VER_1_16_2 = version.parse("1.16.2")
+_ORT_VER_1_17_0 = version.parse("1.17.0")
+# version checks of the passes, computed once
+_ORT_LT_1_16 = _ORT_VERSION is not None and _ORT_VERSION < _ORT_VER_1_16_0
+_ORT_HAS_QNN_CONFIG = _ORT_VERSION is not None and _ORT_VERSION >= _ORT_VER_1_17_0
+
+# number of rows of a weight quantized at once, bounds the size of the float temporaries
+_WEIGHT_QUANT_CHUNK_ROWS = 4096
+
+# directory shared by all quantization passes in the process to cache preprocessed models
+# it outlives the passes so that recurrent passes of the search don't preprocess the same model again
+_quant_cache_dir = None
+# maximum number of preprocessed models kept in the cache dir, the least recently used ones are deleted
+_PREPROCESSED_MODEL_CACHE_SIZE = 8
+# content hashes of the cached preprocessed models, from least to most recently used
+_preprocessed_model_hashes = OrderedDict()
+
 # common config for both static and dynamic quantization
 _onnx_quantization_config = {
     "weight_type": PassConfigParam(
@@ -92,6 +152,15 @@ _onnx_quantization_config = {
             https://onnxruntime.ai/docs/performance/quantization.html#pre-processing
         """,
     ),
+    "skip_preprocess_if_shaped": PassConfigParam(
+        type_=bool,
+        default_value=True,
+        description="""
+            Skip the quantization preprocessing if the model already has shape information for all
+            intermediate tensors, e.g. it was already preprocessed or optimized by a previous pass.
+            Only used if quant_preprocess is True.
+        """,
+    ),
 }
 
 _exposed_extra_options_config = {
@@ -174,6 +243,14 @@ _static_dataloader_config = {
             dataloader_func is None.
         """,
     ),
+    "calib_prefetch": PassConfigParam(
+        type_=int,
+        default_value=4,
+        description="""
+            Number of calibration batches to prepare in a background thread while the calibration
+            inference runs. Set to 0 to get the batches in the main thread.
+        """,
+    ),
 }
 
 _static_optional_config = {
@@ -227,6 +304,515 @@ _static_optional_config = {
     ),
 }
 
+_EXPOSED_EXTRA_OPTION_KEYS = frozenset(_exposed_extra_options_config)
+
+# keys in the pass config that are arguments of quantize_dynamic/quantize_static
+# extra_options is built separately from the exposed extra options
+_ORT_DYNAMIC_ACCEPTED_KEYS = (
+    "weight_type",
+    "op_types_to_quantize",
+    "nodes_to_quantize",
+    "nodes_to_exclude",
+    "per_channel",
+    "reduce_range",
+)
+_ORT_STATIC_ACCEPTED_KEYS = (*_ORT_DYNAMIC_ACCEPTED_KEYS, "calibrate_method", "quant_format", "activation_type")
+
+
+def _get_quant_cache_dir() -> Path:
+    global _quant_cache_dir  # pylint: disable=global-statement
+    if _quant_cache_dir is None:
+        _quant_cache_dir = tempfile.TemporaryDirectory(prefix="olive_quant_cache")
+    return Path(_quant_cache_dir.name)
+
+
+def _track_preprocessed_model(content_hash: str) -> None:
+    """Mark the preprocessed model as most recently used and delete the least recently used ones over the limit."""
+    _preprocessed_model_hashes[content_hash] = None
+    _preprocessed_model_hashes.move_to_end(content_hash)
+    while len(_preprocessed_model_hashes) > _PREPROCESSED_MODEL_CACHE_SIZE:
+        evicted_hash, _ = _preprocessed_model_hashes.popitem(last=False)
+        shutil.rmtree(_get_quant_cache_dir() / evicted_hash, ignore_errors=True)
+
+
+def _get_external_data_file_names(model_path: Union[str, Path]) -> List[str]:
+    """Get the names of the external data files of the onnx model, relative to the model directory."""
+    # only the graph is loaded, the external data is not read
+    model_proto = onnx.load(str(model_path), load_external_data=False)
+    return sorted(
+        {ExternalDataInfo(tensor).location for tensor in _get_all_tensors(model_proto) if uses_external_data(tensor)}
+    )
+
+
+def _hash_onnx_model(model_path: Union[str, Path]) -> str:
+    """Hash the content of the onnx model file and its external data files."""
+    model_path = Path(model_path).resolve()
+    # the external data file names are referenced by the model file, the model file name itself doesn't matter
+    file_paths = [model_path, *(model_path.parent / name for name in _get_external_data_file_names(model_path))]
+    # the content is only hashed again if a file changed, so that every run on the same model doesn't reread the
+    # external data
+    return _hash_files(tuple((str(file_path), *_get_file_stat(file_path)) for file_path in file_paths))
+
+
+def _get_file_stat(file_path: Path) -> Tuple[int, int]:
+    stat = file_path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+@lru_cache(maxsize=64)
+def _hash_files(file_stats: Tuple[Tuple[str, int, int], ...]) -> str:
+    """Hash the content of the files, memoized on their paths, sizes and modification times."""
+    blake2b_hash = hashlib.blake2b(digest_size=16)
+    # the files are read in chunks so that large external data files are not loaded into memory at once
+    for file_path, *_ in file_stats:
+        with open(file_path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                blake2b_hash.update(chunk)
+    return blake2b_hash.hexdigest()
+
+
+def _has_complete_value_info(model_path: Union[str, Path]) -> bool:
+    """Check if the main graph of the onnx model has shape information for all intermediate tensors."""
+    # only the graph is loaded, the external data is not read
+    graph = onnx.load(str(model_path), load_external_data=False).graph
+    shaped_names = {value_info.name for value_info in graph.value_info if value_info.type.tensor_type.HasField("shape")}
+    output_names = {output.name for output in graph.output}
+    return all(name in shaped_names for node in graph.node for name in node.output if name and name not in output_names)
+
+
+def _is_ort_external_data_layout(
+    model_proto: onnx.ModelProto, output_model_path: Union[str, Path], external_data_config: Dict[str, Any]
+) -> bool:
+    """Check if saving the model in onnxruntime's external data layout satisfies the external data config.
+
+    onnxruntime quantization tools save all tensors >= 1024 bytes, including attribute tensors, to a single
+    "<model_name>.data" file next to the model.
+    """
+    if not (
+        external_data_config["save_as_external_data"]
+        and external_data_config["all_tensors_to_one_file"]
+        and external_data_config["external_data_name"] in (None, f"{Path(output_model_path).name}.data")
+        and external_data_config["size_threshold"] == 1024
+    ):
+        return False
+    # attribute tensors must not be saved as external data unless convert_attribute is True
+    # same size check as onnx.external_data_helper.convert_model_to_external_data
+    return external_data_config["convert_attribute"] or not any(
+        uses_external_data(tensor) or (tensor.HasField("raw_data") and sys.getsizeof(tensor.raw_data) >= 1024)
+        for tensor in _get_attribute_tensors(model_proto)
+    )
+
+
+def _move_onnx_model(
+    model_path: Union[str, Path], output_model_path: Union[str, Path], external_data_config: Dict[str, Any]
+) -> Optional[ONNXModelHandler]:
+    """Move the onnx model and its external data to the output path if it is saved in the requested layout.
+
+    This avoids loading the model with its external data into memory and saving it again.
+
+    :return: The ONNXModelHandler of the moved model, or None if the model needs to be saved again.
+    """
+    model_path = Path(model_path)
+    output_model_path = Path(output_model_path)
+    # the model is saved by onnxruntime quantization with the same file name as the output model
+    if not _is_ort_external_data_layout(
+        onnx.load(str(model_path), load_external_data=False), output_model_path, external_data_config
+    ):
+        return None
+
+    output_model_path.parent.mkdir(parents=True, exist_ok=True)
+    external_data_name = f"{output_model_path.name}.data"
+    for src_path, dst_path in (
+        (model_path.parent / external_data_name, output_model_path.parent / external_data_name),
+        (model_path, output_model_path),
+    ):
+        if src_path.exists():
+            dst_path.unlink(missing_ok=True)
+            shutil.move(str(src_path), str(dst_path))
+    return ONNXModelHandler(
+        model_path=LocalFolder({"path": output_model_path.parent}), onnx_file_name=output_model_path.name
+    )
+
+
+def _quantize_one(
+    model_path: str, tmp_model_path: str, run_config: Dict[str, Any], is_static: bool, calibration_data_reader=None
+) -> None:
+    """Quantize the model and save it to tmp_model_path with external data.
+
+    :param model_path: Path to the (preprocessed) model to quantize.
+    :param tmp_model_path: Path to save the quantized model to.
+    :param run_config: Keyword arguments for quantize_static or quantize_dynamic. For static quantization, this
+        includes calibration_cache_path if the calibration ranges are cached.
+    :param is_static: Whether to use static quantization, otherwise dynamic quantization.
+    :param calibration_data_reader: Calibration data reader for static quantization. It can be None if the
+        calibration ranges are loaded from calibration_cache_path.
+    """
+    if is_static:
+        try:
+            quantize_static(
+                model_input=model_path,
+                model_output=tmp_model_path,
+                calibration_data_reader=calibration_data_reader,
+                use_external_data_format=True,
+                **run_config,
+            )
+        except (AttributeError, ValueError) as e:
+            raise OlivePassError("quantize_static failed.") from e
+    else:
+        try:
+            quantize_dynamic(
+                model_input=model_path,
+                model_output=tmp_model_path,
+                use_external_data_format=True,
+                **run_config,
+            )
+        except (AttributeError, ValueError) as e:
+            raise OlivePassError("quantize_dynamic failed.") from e
+
+
+def _load_float_weight(tensor: onnx.TensorProto, base_dir: Path) -> np.ndarray:
+    """Get the data of a float initializer, memory-mapping it if it is stored in an external data file."""
+    if not uses_external_data(tensor):
+        return onnx.numpy_helper.to_array(tensor)
+    external_data_info = ExternalDataInfo(tensor)
+    return np.memmap(
+        base_dir / external_data_info.location,
+        dtype="<f4",
+        mode="r",
+        offset=external_data_info.offset or 0,
+        shape=tuple(tensor.dims),
+    )
+
+
+def _quantize_weight_symmetric_int8(weight: np.ndarray, qmax: int, per_channel: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize the weight symmetrically to int8 in [-qmax, qmax], per tensor or per channel of the last axis.
+
+    Computes the same scales and quantized values as onnxruntime's quantize_data. The weight is processed in chunks of
+    rows so that no full size float temporaries are created for memory-mapped weights.
+
+    :return: The quantized weight and the scale with shape [] (per tensor) or [channels] (per channel).
+    """
+    rows = weight.reshape(-1, weight.shape[-1])
+    absmax = np.zeros(rows.shape[1], dtype=np.float32)
+    for start in range(0, rows.shape[0], _WEIGHT_QUANT_CHUNK_ROWS):
+        np.maximum(absmax, np.abs(rows[start : start + _WEIGHT_QUANT_CHUNK_ROWS]).max(axis=0), out=absmax)
+    if not per_channel:
+        absmax = absmax.max(keepdims=True)
+
+    # scale = (rmax - rmin) / (qmax - qmin) with rmax = -rmin = absmax, computed in float64 like onnxruntime
+    scale = absmax.astype(np.float64) * 2 / (qmax * 2)
+    scale[scale < np.finfo(np.float32).tiny] = 1.0
+    scale = scale.astype(np.float32)
+
+    quantized = np.empty(rows.shape, dtype=np.int8)
+    for start in range(0, rows.shape[0], _WEIGHT_QUANT_CHUNK_ROWS):
+        chunk = (rows[start : start + _WEIGHT_QUANT_CHUNK_ROWS] / scale).round()
+        quantized[start : start + _WEIGHT_QUANT_CHUNK_ROWS] = np.clip(chunk, -128, 127, out=chunk)
+    return quantized.reshape(weight.shape), scale if per_channel else scale.reshape(())
+
+
+def _quantize_dynamic_matmul_int8(model_path: str, tmp_model_path: str, run_config: Dict[str, Any]) -> bool:
+    """Dynamically quantize the MatMul nodes of the model with int8 weights without going through quantize_dynamic.
+
+    Produces the same graph as quantize_dynamic with op_types_to_quantize=["MatMul"]: the input is quantized by
+    DynamicQuantizeLinear and the constant weight symmetrically to int8, followed by MatMulInteger, Cast and a Mul with
+    the product of the scales. quantize_dynamic decodes every weight through protobuf and quantizes per-channel weights
+    one channel at a time, which is slow for large models. Here the weights in external data files are memory-mapped
+    and quantized with vectorized numpy.
+
+    The node and tensor names and the model metadata mirror onnxruntime's internal ONNXQuantizer, checked against
+    onnxruntime 1.31. test_quantize_dynamic_matmul_int8 compares the output with quantize_dynamic of the installed
+    version, so it has to be updated if onnxruntime changes them.
+
+    :return: True if the model was quantized and saved to tmp_model_path in onnxruntime's external data layout,
+        False if the config or the model is not supported and quantize_dynamic should be used instead.
+    """
+    extra_options = run_config["extra_options"]
+    if not (
+        run_config["op_types_to_quantize"] == ["MatMul"]
+        and run_config["weight_type"] == QuantType.QInt8
+        and extra_options.get("MatMulConstBOnly")
+        and extra_options.get("WeightSymmetric", True)
+        # other extra options are only handled by quantize_dynamic
+        and extra_options.keys() <= _EXPOSED_EXTRA_OPTION_KEYS
+    ):
+        return False
+
+    from onnxruntime.quantization.quant_utils import __producer__, add_infer_metadata
+    from onnxruntime.quantization.quant_utils import __version__ as __quant_version__
+
+    model_path = Path(model_path)
+    model_proto = onnx.load(str(model_path), load_external_data=False)
+    graph = model_proto.graph
+    opset_version = next((opset.version for opset in model_proto.opset_import if opset.domain in ("", "ai.onnx")), 0)
+    # DynamicQuantizeLinear requires opset 11, subgraphs can use the weights from the outer scope
+    if opset_version < 11 or any(
+        attr.type in (onnx.AttributeProto.GRAPH, onnx.AttributeProto.GRAPHS)
+        for node in graph.node
+        for attr in node.attribute
+    ):
+        return False
+    initializers = {initializer.name: initializer for initializer in graph.initializer}
+    if any(graph_input.name in initializers for graph_input in graph.input):
+        return False
+
+    nodes_to_quantize = run_config["nodes_to_quantize"]
+    nodes_to_exclude = run_config["nodes_to_exclude"] or []
+    matmul_nodes = []
+    for node in graph.node:
+        if (
+            node.op_type != "MatMul"
+            or node.domain not in ("", "ai.onnx")
+            or (nodes_to_quantize and node.name not in nodes_to_quantize)
+            or node.name in nodes_to_exclude
+            # MatMulConstBOnly
+            or node.input[1] not in initializers
+        ):
+            continue
+        weight_type = initializers[node.input[1]].data_type
+        if weight_type in (onnx.TensorProto.FLOAT16, onnx.TensorProto.BFLOAT16, onnx.TensorProto.DOUBLE):
+            return False
+        if weight_type != onnx.TensorProto.FLOAT:
+            # integer MatMul, not quantized
+            continue
+        if node.input[0] in initializers:
+            return False
+        matmul_nodes.append(node)
+    if not matmul_nodes:
+        return False
+
+    # same as onnxruntime's symmetric and reduced int8 ranges
+    qmax = 64 if run_config["reduce_range"] else 127
+    # name -> (quantized name, scale name, zero point name)
+    quantized_inputs = {}
+    quantized_weights = {}
+    scales_mul_outputs = {}
+    matmul_node_ids = {id(node) for node in matmul_nodes}
+    new_nodes = []
+    new_initializers = []
+    for node in graph.node:
+        if id(node) not in matmul_node_ids:
+            new_nodes.append(node)
+            continue
+
+        input_name, weight_name = node.input[0], node.input[1]
+        if input_name not in quantized_inputs:
+            quantized_inputs[input_name] = (
+                f"{input_name}_quantized",
+                f"{input_name}_scale",
+                f"{input_name}_zero_point",
+            )
+            new_nodes.append(
+                onnx.helper.make_node(
+                    "DynamicQuantizeLinear",
+                    [input_name],
+                    list(quantized_inputs[input_name]),
+                    f"{input_name}_QuantizeLinear",
+                )
+            )
+        if weight_name not in quantized_weights:
+            quantized_weights[weight_name] = (
+                f"{weight_name}_quantized",
+                f"{weight_name}_scale",
+                f"{weight_name}_zero_point",
+            )
+            weight = _load_float_weight(initializers[weight_name], model_path.parent)
+            quantized_weight, scale = _quantize_weight_symmetric_int8(weight, qmax, run_config["per_channel"])
+            del weight
+            new_initializers.extend(
+                [
+                    onnx.numpy_helper.from_array(quantized_weight, quantized_weights[weight_name][0]),
+                    onnx.numpy_helper.from_array(scale, quantized_weights[weight_name][1]),
+                    onnx.numpy_helper.from_array(
+                        np.zeros(scale.shape, dtype=np.int8), quantized_weights[weight_name][2]
+                    ),
+                ]
+            )
+
+        # node names and outputs are the same as onnxruntime's MatMulInteger quantizer
+        input_q, input_scale, input_zp = quantized_inputs[input_name]
+        weight_q, weight_scale, weight_zp = quantized_weights[weight_name]
+        matmul_integer_name = f"{node.name}_quant" if node.name else ""
+        matmul_integer_output = f"{node.output[0]}_output_quantized"
+        cast_output = f"{matmul_integer_output}_cast_output"
+        scales_mul_name = f"{matmul_integer_name}_scales_mul" if node.name else f"{input_scale}_{weight_scale}_mul"
+        new_nodes.append(
+            onnx.helper.make_node(
+                "MatMulInteger",
+                [input_q, weight_q, input_zp, weight_zp],
+                [matmul_integer_output],
+                matmul_integer_name,
+            )
+        )
+        new_nodes.append(
+            onnx.helper.make_node(
+                "Cast",
+                [matmul_integer_output],
+                [cast_output],
+                f"{matmul_integer_output}_cast",
+                to=onnx.TensorProto.FLOAT,
+            )
+        )
+        if scales_mul_name not in scales_mul_outputs:
+            scales_mul_outputs[scales_mul_name] = f"{scales_mul_name}:0"
+            new_nodes.append(
+                onnx.helper.make_node(
+                    "Mul", [input_scale, weight_scale], [scales_mul_outputs[scales_mul_name]], scales_mul_name
+                )
+            )
+        new_nodes.append(
+            onnx.helper.make_node(
+                "Mul",
+                [cast_output, scales_mul_outputs[scales_mul_name]],
+                [node.output[0]],
+                f"{matmul_integer_name}_output_scale_mul" if node.name else "",
+            )
+        )
+
+    del graph.node[:]
+    graph.node.extend(new_nodes)
+    # remove the float weights that are not used anymore
+    used_names = {name for node in graph.node for name in node.input} | {output.name for output in graph.output}
+    kept_initializers = [
+        initializer
+        for initializer in graph.initializer
+        if initializer.name not in quantized_weights or initializer.name in used_names
+    ]
+    del graph.initializer[:]
+    graph.initializer.extend(kept_initializers + new_initializers)
+
+    # same model metadata as quantize_dynamic
+    model_proto.producer_name = __producer__
+    model_proto.producer_version = __quant_version__
+    add_infer_metadata(model_proto)
+
+    # the external data of the remaining tensors is saved again next to the quantized model
+    for tensor in _get_all_tensors(model_proto):
+        if uses_external_data(tensor):
+            load_external_data_for_tensor(tensor, str(model_path.parent))
+            tensor.data_location = onnx.TensorProto.DEFAULT
+            del tensor.external_data[:]
+    onnx.save_model(
+        model_proto,
+        tmp_model_path,
+        save_as_external_data=True,
+        all_tensors_to_one_file=True,
+        location=f"{Path(tmp_model_path).name}.data",
+        size_threshold=1024,
+        convert_attribute=True,
+    )
+    logger.debug("Quantized %d MatMul nodes with int8 weights without quantize_dynamic", len(matmul_nodes))
+    return True
+
+
+def _hash_calibration_data(dataloader) -> str:
+    """Hash the calibration data.
+
+    The batches are hashed one at a time without being kept in memory, so the dataloader is consumed and a new one
+    must be created for calibration.
+    """
+    blake2b_hash = hashlib.blake2b(digest_size=16)
+    for batch in iter(dataloader.get_next, None):
+        for name in sorted(batch):
+            value = np.asarray(batch[name])
+            blake2b_hash.update(f"{name}:{value.dtype}:{value.shape}".encode())
+            blake2b_hash.update(value.tobytes())
+    return blake2b_hash.hexdigest()
+
+
+class _PrefetchingCalibrationDataReader(CalibrationDataReader):
+    """Calibration data reader that gets up to `prefetch` batches ahead on a background thread.
+
+    quantize_static runs the calibration inference on a batch before getting the next one, so this overlaps the
+    batch preparation of the data reader with the inference. The thread is only started on the first get_next call,
+    so nothing is read if the calibration ranges are loaded from the cache.
+    """
+
+    def __init__(self, data_reader, prefetch: int):
+        self.data_reader = data_reader
+        self.batches = queue.Queue(maxsize=prefetch)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.exhausted = False
+
+    def _put(self, item) -> bool:
+        # don't block forever if the consumer stops getting batches, e.g. quantize_static raised
+        while not self.stop_event.is_set():
+            try:
+                self.batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            while not self.stop_event.is_set():
+                batch = self.data_reader.get_next()
+                # same end condition as the calibrators of onnxruntime
+                if not self._put(batch) or not batch:
+                    break
+        except Exception as e:  # pylint: disable=broad-except
+            # raise it in the thread that gets the batches
+            self._put(e)
+
+    def get_next(self):
+        if self.exhausted:
+            return None
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._produce, daemon=True)
+            self.thread.start()
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            self.exhausted = True
+            raise batch
+        self.exhausted = not batch
+        return batch
+
+    def close(self):
+        """Stop the background thread."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def _make_static_optional_config_for_quant_mode() -> Dict[str, PassConfigParam]:
+    """Get the static optional config for the pass that searches over quant_mode.
+
+    The parameters are only used if quant_mode is static.
+    """
+    static_optional_config = deepcopy(_static_optional_config)
+    for value in static_optional_config.values():
+        # default value is conditional on quant_mode
+        # if quant_mode is static, use the default value in static_optional_config
+        # if quant_mode is dynamic, set default value as ignored. dynamic quantization doesn't use this parameter
+        value.default_value = ConditionalDefault(
+            parents=("quant_mode",),
+            support={("static",): value.default_value, ("dynamic",): ConditionalDefault.get_ignored_choice()},
+        )
+        if isinstance(value.searchable_values, Categorical):
+            # ignore the parameter if quant_mode is dynamic
+            # if quant_mode is static, use the searchable_values in static_optional_config by making it conditional
+            value.searchable_values = Conditional(
+                parents=("quant_mode",),
+                support={("static",): value.searchable_values},
+                default=Conditional.get_ignored_choice(),
+            )
+        elif isinstance(value.searchable_values, Conditional):
+            # ignore the parameter if quant_mode is dynamic
+            # if quant_mode is static, use the searchable_values in static_optional_config by expanding the parents
+            value.searchable_values = Conditional(
+                parents=("quant_mode", *value.searchable_values.parents),
+                support={
+                    ("static", *key): value.searchable_values.support[key] for key in value.searchable_values.support
+                },
+                default=Conditional.get_ignored_choice(),
+            )
+    return static_optional_config
+
+
+_static_optional_config_for_quant_mode = _make_static_optional_config_for_quant_mode()
+
 
 class OnnxQuantization(Pass):
     """Quantize ONNX model with static/dynamic quantization techniques."""
@@ -240,6 +826,13 @@ class OnnxQuantization(Pass):
 
     @classmethod
     def _default_config(cls, accelerator_spec: AcceleratorSpec) -> Dict[str, PassConfigParam]:
+        # the default config is assembled only once per execution provider since passes are created many times
+        # during search. The config params are shared between calls so they must not be modified.
+        return dict(cls._build_default_config(accelerator_spec.execution_provider))
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _build_default_config(cls, execution_provider: str) -> Mapping[str, PassConfigParam]:
         config = {
             "quant_mode": PassConfigParam(
                 type_=str,
@@ -257,35 +850,7 @@ class OnnxQuantization(Pass):
 
         # static quantization config
         config.update(deepcopy(_static_dataloader_config))
-        static_optional_config = deepcopy(_static_optional_config)
-        for value in static_optional_config.values():
-            # default value is conditional on quant_mode
-            # if quant_mode is static, use the default value in static_optional_config
-            # if quant_mode is dynamic, set default value as ignored. dynamic quantization doesn't use this parameter
-            value.default_value = ConditionalDefault(
-                parents=("quant_mode",),
-                support={("static",): value.default_value, ("dynamic",): ConditionalDefault.get_ignored_choice()},
-            )
-            if isinstance(value.searchable_values, Categorical):
-                # ignore the parameter if quant_mode is dynamic
-                # if quant_mode is static, use the searchable_values in static_optional_config by making it conditional
-                value.searchable_values = Conditional(
-                    parents=("quant_mode",),
-                    support={("static",): value.searchable_values},
-                    default=Conditional.get_ignored_choice(),
-                )
-            elif isinstance(value.searchable_values, Conditional):
-                # ignore the parameter if quant_mode is dynamic
-                # if quant_mode is static, use the searchable_values in static_optional_config by expanding the parents
-                value.searchable_values = Conditional(
-                    parents=("quant_mode", *value.searchable_values.parents),
-                    support={
-                        ("static", *key): value.searchable_values.support[key]
-                        for key in value.searchable_values.support
-                    },
-                    default=Conditional.get_ignored_choice(),
-                )
-        config.update(static_optional_config)
+        config.update(deepcopy(_static_optional_config_for_quant_mode))
 
         # exposed extra options config
         config.update(deepcopy(_exposed_extra_options_config))
@@ -293,7 +858,7 @@ class OnnxQuantization(Pass):
 
         # external data config
         config.update(get_external_data_config())
-        return config
+        return MappingProxyType(config)
 
     def validate_search_point(
         self, search_point: Dict[str, Any], accelerator_spec: AcceleratorSpec, with_fixed_value: bool = False
@@ -321,24 +886,23 @@ class OnnxQuantization(Pass):
     def _run_for_config(
         self, model: ONNXModelHandler, data_root: str, config: Dict[str, Any], output_model_path: str
     ) -> ONNXModelHandler:
-        from onnxruntime import __version__ as OrtVersion
-        from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
-        from onnxruntime.quantization.calibrate import CalibrationMethod
+        if _ORT_VERSION is None:
+            raise ImportError("onnxruntime is not installed. Please install onnxruntime to use this pass.")
 
-        # start with a copy of the config
-        run_config = deepcopy(config)
-        is_static = run_config["quant_mode"] == "static"
+        is_static = config["quant_mode"] == "static"
         if is_static:
             assert (
                 config["dataloader_func"] or config["data_config"]
             ), "dataloader_func or data_config is required for static quantization."
 
-        output_model_path = resolve_onnx_path(output_model_path, Path(model.model_path).name)
+        # model.model_path checks the file system on every access, get it only once
+        model_path = model.model_path
+        output_model_path = resolve_onnx_path(output_model_path, Path(model_path).name)
 
         # extra config
         extra_options = deepcopy(config["extra_options"]) if config["extra_options"] else {}
         # keys in extra_options that are already exposed
-        intersection = set(extra_options.keys()).intersection(set(_exposed_extra_options_config.keys()))
+        intersection = _EXPOSED_EXTRA_OPTION_KEYS & extra_options.keys()
         if intersection:
             logger.warning(
                 "Extra config keys %s are already exposed in the pass config. They will be overwritten by"
@@ -346,71 +910,51 @@ class OnnxQuantization(Pass):
                 intersection,
             )
         for key in _exposed_extra_options_config:
-            extra_options[key] = run_config[key]
-            del run_config[key]
+            extra_options[key] = config[key]
 
-        # preprocess the model
-        # we hash the entire path of the input model to ensure we are not accidentally using a preprocessed model
-        # from a different model
-        preprocessed_temp_model_path = (
-            Path(self.tmp_dir.name) / f"{hash_string(str(Path(model.model_path).resolve()))}" / "preprocessed.onnx"
+        # cache the calibrated tensor ranges so that search points which only differ in options that don't
+        # affect calibration (per_channel, quant_format, nodes_to_exclude, etc.) skip the calibration run
+        # only supported by quantize_static in newer versions of onnxruntime
+        use_calibration_cache = (
+            is_static and _ORT_SUPPORTS_CALIBRATION_CACHE and not extra_options.get("CalibStridedMinMax")
         )
-        preprocessed_temp_model_path.parent.mkdir(exist_ok=True, parents=True)
-        if run_config["quant_preprocess"]:
-            if not preprocessed_temp_model_path.exists():
+
+        # preprocess the model
+        # we hash the content of the input model so that the same model at different paths shares the preprocessed
+        # model and calibration ranges, and a modified model at the same path is not matched with stale ones
+        # the model is only hashed if the hash is used
+        model_hash = _hash_onnx_model(model_path) if config["quant_preprocess"] or use_calibration_cache else None
+        use_preprocessed_model = False
+        if config["quant_preprocess"]:
+            preprocessed_model_path = self._get_or_preprocess(
+                model_hash, model_path, config["skip_preprocess_if_shaped"]
+            )
+            if preprocessed_model_path is not None:
                 # overwrite the model path with the preprocessed model path
-                logger.info("Preprocessing model for quantization")
-                model = self._quant_preprocess(model, preprocessed_temp_model_path)
-            else:
-                logger.info("Already processed model for quantization, skipping preprocessing")
-                model = ONNXModelHandler(LocalFile({"path": preprocessed_temp_model_path}))
+                model_path = str(preprocessed_model_path)
+                use_preprocessed_model = True
 
         # whether to prepare qnn config
-        if run_config.get("prepare_qnn_config", False) and version.parse(OrtVersion) < version.parse("1.17.0"):
+        if config.get("prepare_qnn_config", False) and not _ORT_HAS_QNN_CONFIG:
             raise OlivePassError("prepare_qnn_config is only supported for onnxruntime-qnn>=1.17.0")
 
-        # keys not needed for quantization
-        to_delete = [
-            "quant_mode",
-            "script_dir",
-            "user_script",
-            "quant_preprocess",
-            "data_config",
-            "prepare_qnn_config",
-        ]
-        to_delete += list(get_external_data_config().keys())
-
-        # update string values to enum values
+        # only pass the arguments of quantize_static/quantize_dynamic, with string values converted to enum values
+        # lists are copied since onnxruntime can modify them, e.g. nodes_to_exclude with SmoothQuant
+        run_config = {
+            key: list(config[key]) if isinstance(config[key], list) else config[key]
+            for key in (_ORT_STATIC_ACCEPTED_KEYS if is_static else _ORT_DYNAMIC_ACCEPTED_KEYS)
+        }
+        run_config["weight_type"] = QuantType[run_config["weight_type"]]
+        run_config["extra_options"] = extra_options
         if is_static:
-            to_delete += list(_static_dataloader_config.keys())
-            run_config.update(
-                {
-                    "calibrate_method": CalibrationMethod[run_config["calibrate_method"]],
-                    "quant_format": QuantFormat[run_config["quant_format"]],
-                    "activation_type": QuantType[run_config["activation_type"]],
-                    "weight_type": QuantType[run_config["weight_type"]],
-                    "extra_options": extra_options,
-                }
-            )
-        else:
-            to_delete += list(_static_dataloader_config.keys())
-            to_delete += list(_static_optional_config.keys())
-            run_config.update(
-                {
-                    "weight_type": QuantType[run_config["weight_type"]],
-                    "extra_options": extra_options,
-                }
-            )
-
-        # remove keys not needed for quantization
-        for key in to_delete:
-            if key in run_config:
-                del run_config[key]
+            run_config["calibrate_method"] = CalibrationMethod[run_config["calibrate_method"]]
+            run_config["quant_format"] = QuantFormat[run_config["quant_format"]]
+            run_config["activation_type"] = QuantType[run_config["activation_type"]]
 
         # for ORT version < 1.16.0, set optimize_model to False
         # always set it to False since it is not recommended and is removed in ORT 1.16.0
         # user needs to call pre-process to optimize the model, we already have pre-process option
-        if version.parse(OrtVersion) < version.parse("1.16.0"):
+        if _ORT_LT_1_16:
             run_config["optimize_model"] = False
 
         # to be safe, run the quantizer with use_external_data_format set to `True` and
@@ -418,31 +962,36 @@ class OnnxQuantization(Pass):
         # reload the model and save to output_model_path using the external data config
         # TODO(jambayk): don't default to use_external_data_format=True if the loading and saving model makes
         # the pass inefficient
-        new_tmp_dir = tempfile.TemporaryDirectory(prefix="olive_tmp")
-        tmp_model_path = str(Path(new_tmp_dir.name) / Path(output_model_path).name)
+        # use a subdirectory of the pass's tmp dir unique to the output path instead of a new tmp dir per run
+        # remove leftovers of a failed run first, onnxruntime appends to existing external data files
+        tmp_subdir = Path(self.tmp_dir.name) / f"out_{hash_string(str(output_model_path))}"
+        shutil.rmtree(tmp_subdir, ignore_errors=True)
+        tmp_subdir.mkdir(parents=True)
+        tmp_model_path = str(tmp_subdir / Path(output_model_path).name)
 
         if is_static:
-            # get the dataloader
-            # TODO(trajep): only use data config
-            if config["dataloader_func"]:
-                data_dir = get_local_path_from_root(data_root, config["data_dir"])
-                dataloader = self._user_module_loader.call_object(
-                    config["dataloader_func"],
-                    data_dir,
-                    config["batch_size"],
-                    **(config["dataloader_func_kwargs"] or {}),
+            if use_calibration_cache:
+                # hashing consumes the dataloader, create a new one for calibration
+                try:
+                    data_hash = _hash_calibration_data(self._get_dataloader(data_root, config))
+                except (AttributeError, ValueError) as e:
+                    raise OlivePassError("Failed to read the calibration data.") from e
+            dataloader = self._get_dataloader(data_root, config)
+            prefetching_dataloader = None
+            if config["calib_prefetch"] > 0 and not (
+                # the data reader is deep copied for smooth quant and strided calibration sets its range
+                extra_options.get("SmoothQuant")
+                or extra_options.get("CalibStridedMinMax")
+            ):
+                dataloader = prefetching_dataloader = _PrefetchingCalibrationDataReader(
+                    dataloader, config["calib_prefetch"]
                 )
-            elif config["data_config"]:
-                data_config = validate_config(config["data_config"], DataConfig)
-                dataloader = data_config.to_data_container().create_calibration_dataloader(data_root)
 
             if config["prepare_qnn_config"]:
-                import inspect
-
                 from onnxruntime.quantization.execution_providers.qnn import get_qnn_qdq_config
 
                 qnn_config = get_qnn_qdq_config(
-                    model_input=model.model_path,
+                    model_input=model_path,
                     calibration_data_reader=dataloader,
                     calibrate_method=run_config["calibrate_method"],
                     activation_type=run_config["activation_type"],
@@ -458,43 +1007,108 @@ class OnnxQuantization(Pass):
             for key in ("calibration_data_reader", "use_external_data_format"):
                 if key in run_config:
                     del run_config[key]
-            try:
-                quantize_static(
-                    model_input=model.model_path,
-                    model_output=tmp_model_path,
-                    calibration_data_reader=dataloader,
-                    use_external_data_format=True,
-                    **run_config,
+
+            if use_calibration_cache:
+                calibration_options = {
+                    k: v
+                    for k, v in (run_config.get("extra_options") or {}).items()
+                    if k.startswith(("Calib", "SmoothQuant"))
+                }
+                calibration_cache_key = hash_dict(
+                    {
+                        "model_hash": model_hash,
+                        "quant_preprocess": use_preprocessed_model,
+                        "data_hash": data_hash,
+                        "calibrate_method": run_config["calibrate_method"].name,
+                        "op_types_to_quantize": run_config.get("op_types_to_quantize"),
+                        "calibration_options": calibration_options,
+                        # smooth quant calibrates the model transformed with reduce_range
+                        "reduce_range": (
+                            run_config.get("reduce_range") if calibration_options.get("SmoothQuant") else None
+                        ),
+                    }
                 )
-            except (AttributeError, ValueError) as e:
-                raise OlivePassError("quantize_static failed.") from e
-        else:
-            try:
-                quantize_dynamic(
-                    model_input=model.model_path,
-                    model_output=tmp_model_path,
-                    use_external_data_format=True,
-                    **run_config,
+                run_config["calibration_cache_path"] = str(
+                    _get_quant_cache_dir() / "calib" / f"{calibration_cache_key}.json"
                 )
-            except (AttributeError, ValueError) as e:
-                raise OlivePassError("quantize_dynamic failed.") from e
+            try:
+                _quantize_one(model_path, tmp_model_path, run_config, True, calibration_data_reader=dataloader)
+            finally:
+                # stop the background thread in case quantize_static stopped getting batches
+                if prefetching_dataloader is not None:
+                    prefetching_dataloader.close()
+        elif not _quantize_dynamic_matmul_int8(model_path, tmp_model_path, run_config):
+            _quantize_one(model_path, tmp_model_path, run_config, False)
 
-        # load the model
-        onnx_model = onnx.load(tmp_model_path)
-        # the model is loaded into memory, so it's safe to delete previously exported files
-        # NOTE: Don't cleanup self.tmp_dir to avoid preprocessing the same model again during
-        # recurrent passes of the search.
-        new_tmp_dir.cleanup()
+        # move the model to the output path if it is already saved in the requested external data layout
+        # otherwise, load the model and save it to the output path using the external data config
+        olive_model = _move_onnx_model(tmp_model_path, output_model_path, config)
+        if olive_model is None:
+            olive_model = model_proto_to_olive_model(onnx.load(tmp_model_path), output_model_path, config)
+        # NOTE: only cleanup the subdirectory, self.tmp_dir is reused by the recurrent passes of the search
+        shutil.rmtree(tmp_subdir, ignore_errors=True)
 
-        # save the model to the output path and return the model
-        return model_proto_to_olive_model(onnx_model, output_model_path, config)
+        return olive_model
+
+    def _get_dataloader(self, data_root: str, config: Dict[str, Any]):
+        """Create a new calibration dataloader from dataloader_func or data_config."""
+        # TODO(trajep): only use data config
+        if config["dataloader_func"]:
+            data_dir = get_local_path_from_root(data_root, config["data_dir"])
+            return self._user_module_loader.call_object(
+                config["dataloader_func"],
+                data_dir,
+                config["batch_size"],
+                **(config["dataloader_func_kwargs"] or {}),
+            )
+        data_config = validate_config(config["data_config"], DataConfig)
+        return data_config.to_data_container().create_calibration_dataloader(data_root)
+
+    @classmethod
+    def _get_or_preprocess(
+        cls, content_hash: str, model_path: Union[str, Path], skip_if_shaped: bool = False
+    ) -> Optional[Path]:
+        """Get the preprocessed model from the cache or preprocess the model.
+
+        The preprocessed model is cached by the content hash of the input model in the cache dir shared by all
+        quantization passes in the process, so that e.g. static and dynamic quantization of the same model only
+        preprocess it once. Only the most recently used preprocessed models are kept.
+
+        :param content_hash: Hash of the content of the input model.
+        :param model_path: Path to the input model.
+        :param skip_if_shaped: Don't preprocess the model if it already has shape information for all tensors.
+        :return: The path of the preprocessed model, or None if the input model is used as is.
+        """
+        preprocessed_model_path = _get_quant_cache_dir() / content_hash / "preprocessed.onnx"
+        if preprocessed_model_path.exists():
+            logger.info("Already processed model for quantization, skipping preprocessing")
+            _track_preprocessed_model(content_hash)
+            return preprocessed_model_path
+        if skip_if_shaped and _has_complete_value_info(model_path):
+            # the model is used as is, there is no need to copy it
+            logger.info("Model already has shape information for all tensors, skipping preprocessing")
+            return None
 
-    def _quant_preprocess(self, model: ONNXModelHandler, output_model_path: Union[str, Path]) -> ONNXModelHandler:
+        logger.info("Preprocessing model for quantization")
+        # preprocess in a staging dir that is renamed when done, an interrupted preprocessing is never used as cached
+        staging_dir = Path(tempfile.mkdtemp(prefix=f"{content_hash}_", dir=_get_quant_cache_dir()))
+        try:
+            cls._quant_preprocess(model_path, staging_dir / preprocessed_model_path.name)
+            staging_dir.rename(preprocessed_model_path.parent)
+        except Exception:
+            # don't leave a partially written staging dir in the shared cache dir
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        _track_preprocessed_model(content_hash)
+        return preprocessed_model_path
+
+    @staticmethod
+    def _quant_preprocess(model_path: Union[str, Path], output_model_path: Union[str, Path]) -> ONNXModelHandler:
         from onnxruntime.quantization.preprocess import quant_pre_process
 
         try:
             quant_pre_process(
-                input_model_path=model.model_path,
+                input_model_path=str(model_path),
                 output_model_path=str(output_model_path),
                 auto_merge=True,
                 save_as_external_data=True,
@@ -509,13 +1123,14 @@ class OnnxQuantization(Pass):
             logger.warning(
                 "Failed to run quantization preprocessing with error of %s. Using original model.", e, exc_info=True
             )
-            # save original model to output path
-            onnx_model = onnx.load(model.model_path)
-            model_proto_to_file(
-                onnx_model,
-                output_model_path,
-                save_as_external_data=True,  # always save as external data to avoid failures due to large models
-            )
+            # copy original model and its external data files to output path
+            # the files are copied as is to avoid loading the external data into memory and saving it again
+            model_path = Path(model_path)
+            output_model_path = Path(output_model_path)
+            shutil.copyfile(model_path, output_model_path)
+            for file_name in _get_external_data_file_names(model_path):
+                (output_model_path.parent / file_name).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(model_path.parent / file_name, output_model_path.parent / file_name)
 
         # since this is only used internally, we will just treat it as a model file
         return ONNXModelHandler(LocalFile({"path": output_model_path}))
@@ -527,8 +1142,9 @@ class OnnxDynamicQuantization(OnnxQuantization):
     _requires_user_script = False
 
     @classmethod
-    def _default_config(cls, accelerator_spec: AcceleratorSpec) -> Dict[str, PassConfigParam]:
-        if accelerator_spec.execution_provider == "QNNExecutionProvider":
+    @lru_cache(maxsize=None)
+    def _build_default_config(cls, execution_provider: str) -> Mapping[str, PassConfigParam]:
+        if execution_provider == "QNNExecutionProvider":
             raise ValueError("QNNExecutionProvider is not supported for dynamic quantization.")
         config = {
             "quant_mode": PassConfigParam(type_=str, default_value="dynamic", description="dynamic quantization mode")
@@ -540,14 +1156,15 @@ class OnnxDynamicQuantization(OnnxQuantization):
         config.update(deepcopy(_extra_options_config))
         # external data config
         config.update(get_external_data_config())
-        return config
+        return MappingProxyType(config)
 
 
 class OnnxStaticQuantization(OnnxQuantization):
     """ONNX Static Quantization Pass."""
 
     @classmethod
-    def _default_config(cls, accelerator_spec: AcceleratorSpec) -> Dict[str, PassConfigParam]:
+    @lru_cache(maxsize=None)
+    def _build_default_config(cls, execution_provider: str) -> Mapping[str, PassConfigParam]:
         config = {
             "quant_mode": PassConfigParam(type_=str, default_value="static", description="static quantization mode")
         }
@@ -561,16 +1178,17 @@ class OnnxStaticQuantization(OnnxQuantization):
         config.update(deepcopy(_extra_options_config))
         # external data config
         config.update(get_external_data_config())
-        if accelerator_spec.execution_provider == "QNNExecutionProvider":
+        if execution_provider == "QNNExecutionProvider":
             config["quant_format"].searchable_values = Categorical(["QDQ"])
-            # Recently Int16/Uint16 is added into onnx runtime quantization only in QDQ mode.
-            # for QNN EP integration, we give this workaround to support Int16/Uint16 in QDQ mode.
-            # TODO(jiapli): remove this workaround once figure out the Int16/UInt16 in latest quantization
-            config["activation_type"].searchable_values = Categorical(["QInt8", "QUInt8", "QUInt16", "QInt16"])
-            config["weight_type"].searchable_values = Categorical(["QInt8", "QUInt8", "QUInt16", "QInt16"])
+            if _ORT_HAS_INT16:
+                # Recently Int16/Uint16 is added into onnx runtime quantization only in QDQ mode.
+                # for QNN EP integration, we give this workaround to support Int16/Uint16 in QDQ mode.
+                # TODO(jiapli): remove this workaround once figure out the Int16/UInt16 in latest quantization
+                config["activation_type"].searchable_values = Categorical(["QInt8", "QUInt8", "QUInt16", "QInt16"])
+                config["weight_type"].searchable_values = Categorical(["QInt8", "QUInt8", "QUInt16", "QInt16"])
             config["prepare_qnn_config"].default_value = True
             config["quant_preprocess"].default_value = False
-        return config
+        return MappingProxyType(config)
 
 
 class OnnxMatMul4Quantizer(Pass):
@@ -599,17 +1217,19 @@ class OnnxMatMul4Quantizer(Pass):
     def _run_for_config(
         self, model: ONNXModelHandler, data_root: str, config: Dict[str, Any], output_model_path: str
     ) -> ONNXModelHandler:
-        from onnxruntime import __version__ as OrtVersion
-
-        if version.parse(OrtVersion) < version.parse("1.16.2"):
+        if _ORT_VERSION is None:
+            raise ImportError("onnxruntime is not installed. Please install onnxruntime to use this pass.")
+        if _ORT_VERSION < _ORT_VER_1_16_2:
             raise OlivePassError("MatMul4BitsQuantizer is only supported in onnxruntime >= 1.16.2")
 
         from onnxruntime.quantization.matmul_4bits_quantizer import MatMul4BitsQuantizer
 
-        output_model_path = resolve_onnx_path(output_model_path, Path(model.model_path).name)
+        # model.model_path checks the file system on every access, get it only once
+        model_path = model.model_path
+        output_model_path = resolve_onnx_path(output_model_path, Path(model_path).name)
 
         quant = MatMul4BitsQuantizer(
-            model.load_model(), config["block_size"], config["is_symmetric"], config["nodes_to_exclude"]
+            onnx.load(model_path), config["block_size"], config["is_symmetric"], config["nodes_to_exclude"]
         )
         quant.process()
         # topologically sort the graph at the end since previous optimizations may have broken it
@@ -595,7 +595,7 @@ class TestEngine:
             evaluator_config = OliveEvaluatorConfig(metrics=[metric])
             engine = Engine(options, evaluator_config=evaluator_config)
             engine.register(OnnxStaticQuantization, {"dataloader_func": lambda x, y: None})
-            with patch("onnxruntime.quantization.quantize_static") as mock_quantize_static:
+            with patch("olive.passes.onnx.quantization.quantize_static") as mock_quantize_static:
                 mock_quantize_static.side_effect = AttributeError("test")
                 actual_res = engine.run(
                     onnx_model_config, [DEFAULT_CPU_ACCELERATOR], data_root=None, output_dir=output_dir
@@ -609,7 +609,7 @@ class TestEngine:
             }
             engine = Engine(options)
             engine.register(OnnxDynamicQuantization, disable_search=True)
-            with patch("onnxruntime.quantization.quantize_dynamic") as mock_quantize_dynamic:
+            with patch("olive.passes.onnx.quantization.quantize_dynamic") as mock_quantize_dynamic:
                 mock_quantize_dynamic.side_effect = AttributeError("test")
                 actual_res = engine.run(
                     onnx_model_config,
@@ -1,13 +1,50 @@
+import inspect
+import shutil
+from collections import OrderedDict
+from pathlib import Path
 from test.unit_test.utils import get_onnx_model, get_pytorch_model_dummy_input
+from types import SimpleNamespace
+from unittest.mock import patch
 
+import numpy as np
+import onnx
 import pytest
 from onnxruntime import __version__ as OrtVersion
+from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
 from onnxruntime.quantization.calibrate import CalibrationDataReader
 from packaging import version
 
+from olive.exception import OlivePassError
 from olive.hardware.accelerator import AcceleratorSpec
+from olive.model import ONNXModelHandler
 from olive.passes.olive_pass import create_pass_from_dict
-from olive.passes.onnx import OnnxQuantization, OnnxStaticQuantization
+from olive.passes.onnx import (
+    OnnxDynamicQuantization,
+    OnnxQuantization,
+    OnnxStaticQuantization,
+)
+from olive.passes.onnx.quantization import (
+    _ORT_SUPPORTS_CALIBRATION_CACHE,
+    _get_quant_cache_dir,
+    _has_complete_value_info,
+    _hash_calibration_data,
+    _hash_onnx_model,
+    _move_onnx_model,
+    _PrefetchingCalibrationDataReader,
+    _quantize_dynamic_matmul_int8,
+    _quantize_one,
+)
+
+
+@pytest.fixture(autouse=True)
+def quant_cache_dir(tmp_path_factory):
+    # the quantization cache is shared by all passes in the process, isolate it so that tests don't depend on
+    # each other's order
+    cache_dir = tmp_path_factory.mktemp("quant_cache")
+    with patch("olive.passes.onnx.quantization._quant_cache_dir", SimpleNamespace(name=str(cache_dir))), patch(
+        "olive.passes.onnx.quantization._preprocessed_model_hashes", OrderedDict()
+    ):
+        yield cache_dir
 
 
 class DummyCalibrationDataReader(CalibrationDataReader):
@@ -32,6 +69,20 @@ def dummpy_dataloader_func(data_dir, batch_size, *args, **kwargs):
     return DummyCalibrationDataReader(data_dir, batch_size=batch_size)
 
 
+class FixedCalibrationDataReader(CalibrationDataReader):
+    def __init__(self):
+        super().__init__()
+        self.data_iter = iter(np.linspace(-1, 1, 10, dtype=np.float32).reshape(10, 1, 1))
+
+    def get_next(self) -> dict:
+        data = next(self.data_iter, None)
+        return None if data is None else {"input": data}
+
+
+def fixed_dataloader_func(data_dir, batch_size, *args, **kwargs):
+    return FixedCalibrationDataReader()
+
+
 @pytest.mark.parametrize("calibrate_method", ["MinMax", "Entropy", "Percentile"])
 def test_quantization(calibrate_method, tmp_path):
     input_model = get_onnx_model()
@@ -71,3 +122,434 @@ def test_qnn_quantization(tmp_path):
     p = create_pass_from_dict(OnnxStaticQuantization, config, disable_search=True, accelerator_spec=accelerator_spec)
     out = p.run(input_model, None, tmp_path)
     assert out is not None
+
+
+@pytest.mark.skipif(
+    "calibration_cache_path" not in inspect.signature(quantize_static).parameters,
+    reason="calibration cache is not supported by this version of onnxruntime",
+)
+def test_quantization_calibration_cache(tmp_path):
+    input_model = get_onnx_model()
+    calibration_cache_dir = _get_quant_cache_dir() / "calib"
+    for per_channel in (False, True):
+        config = {
+            "quant_mode": "static",
+            "calibrate_method": "MinMax",
+            "per_channel": per_channel,
+            "dataloader_func": fixed_dataloader_func,
+        }
+        p = create_pass_from_dict(OnnxQuantization, config, disable_search=True)
+        out = p.run(input_model, None, tmp_path / f"per_channel_{per_channel}")
+        assert out is not None
+    # the second run only differs in per_channel so it reuses the calibration cache
+    assert len(list(calibration_cache_dir.glob("*.json"))) == 1
+
+
+def test_hash_onnx_model(tmp_path):
+    input_model_path = get_onnx_model().model_path
+    copied_model_path = tmp_path / "copy" / "model.onnx"
+    copied_model_path.parent.mkdir()
+    shutil.copy(input_model_path, copied_model_path)
+    # same content at different paths has the same hash
+    assert _hash_onnx_model(input_model_path) == _hash_onnx_model(copied_model_path)
+
+    # modified content at the same path has a different hash
+    model_proto = onnx.load(copied_model_path)
+    model_proto.producer_name = "modified"
+    onnx.save(model_proto, copied_model_path)
+    assert _hash_onnx_model(input_model_path) != _hash_onnx_model(copied_model_path)
+
+
+@pytest.mark.parametrize("weight_value", [1.0, 5.0])
+def test_hash_onnx_model_external_data(weight_value, tmp_path):
+    model_paths = []
+    for name, value in (("reference", 1.0), ("model", weight_value)):
+        model = get_matmul_model()
+        model.graph.initializer[0].CopyFrom(
+            onnx.numpy_helper.from_array(np.full((64, 64), value, dtype=np.float32), name="weight")
+        )
+        model_path = tmp_path / name / "model.onnx"
+        model_path.parent.mkdir()
+        onnx.save(model, model_path, save_as_external_data=True, location="w.data")
+        model_paths.append(model_path)
+    # same graph with external data of the same size, the hash depends on the weights
+    assert (_hash_onnx_model(model_paths[0]) == _hash_onnx_model(model_paths[1])) == (weight_value == 1.0)
+
+
+def test_hash_onnx_model_memoized(tmp_path):
+    model_path = tmp_path / "model.onnx"
+    onnx.save(get_matmul_model(), model_path, save_as_external_data=True, location="w.data")
+    model_hash = _hash_onnx_model(model_path)
+
+    # the external data is not read again if the files didn't change
+    with patch("olive.passes.onnx.quantization.open", side_effect=AssertionError("file is read again"), create=True):
+        assert _hash_onnx_model(model_path) == model_hash
+
+    # the weights are hashed again after the external data file is modified
+    weight = np.full((64, 64), 5.0, dtype=np.float32)
+    (tmp_path / "w.data").write_bytes(weight.tobytes())
+    assert _hash_onnx_model(model_path) != model_hash
+
+
+def get_matmul_model():
+    weight = onnx.numpy_helper.from_array(np.ones((64, 64), dtype=np.float32), name="weight")
+    graph = onnx.helper.make_graph(
+        [onnx.helper.make_node("MatMul", ["input", "weight"], ["output"], name="MatMul")],
+        "graph",
+        [onnx.helper.make_tensor_value_info("input", onnx.TensorProto.FLOAT, [1, 64])],
+        [onnx.helper.make_tensor_value_info("output", onnx.TensorProto.FLOAT, [1, 64])],
+        initializer=[weight],
+    )
+    return onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 17)])
+
+
+@pytest.mark.parametrize("external_data_name", [None, "weights.data"])
+def test_move_onnx_model(external_data_name, tmp_path):
+    model_path = tmp_path / "tmp" / "model.onnx"
+    model_path.parent.mkdir()
+    # same layout as the model saved by onnxruntime quantization
+    onnx.save(get_matmul_model(), model_path, save_as_external_data=True, location="model.onnx.data")
+
+    external_data_config = {
+        "save_as_external_data": True,
+        "all_tensors_to_one_file": True,
+        "external_data_name": external_data_name,
+        "size_threshold": 1024,
+        "convert_attribute": False,
+    }
+    output_model_path = tmp_path / "output" / "model.onnx"
+    olive_model = _move_onnx_model(model_path, output_model_path, external_data_config)
+    if external_data_name:
+        # the external data file needs to be renamed, so the model is not moved
+        assert olive_model is None
+        assert model_path.exists()
+    else:
+        assert not model_path.exists()
+        assert olive_model.model_path == str(output_model_path)
+        assert (output_model_path.parent / "model.onnx.data").exists()
+        assert np.array_equal(
+            onnx.numpy_helper.to_array(onnx.load(output_model_path).graph.initializer[0]), np.ones((64, 64))
+        )
+
+
+@patch("onnxruntime.quantization.preprocess.quant_pre_process", side_effect=RuntimeError("preprocessing failed"))
+def test_quant_preprocess_failure_copies_model(_, tmp_path):
+    input_model_path = tmp_path / "input" / "model.onnx"
+    input_model_path.parent.mkdir()
+    onnx.save(get_matmul_model(), input_model_path, save_as_external_data=True, location="weights.data")
+
+    p = create_pass_from_dict(OnnxQuantization, {"quant_mode": "dynamic"}, disable_search=True)
+    output_model_path = tmp_path / "output" / "preprocessed.onnx"
+    output_model_path.parent.mkdir()
+    out = p._quant_preprocess(input_model_path, output_model_path)
+
+    # the original model is used with its external data files
+    assert (output_model_path.parent / "weights.data").exists()
+    weight = onnx.numpy_helper.to_array(onnx.load(out.model_path).graph.initializer[0])
+    assert np.array_equal(weight, np.ones((64, 64)))
+
+
+@pytest.mark.parametrize("reduce_range", [True, False])
+@pytest.mark.parametrize("per_channel", [True, False])
+def test_quantize_dynamic_matmul_int8(per_channel, reduce_range, tmp_path):
+    rng = np.random.default_rng(0)
+    # two MatMuls sharing the input, one of them unnamed
+    graph = onnx.helper.make_graph(
+        [
+            onnx.helper.make_node("MatMul", ["input", "weight_0"], ["output_0"], name="MatMul_0"),
+            onnx.helper.make_node("MatMul", ["input", "weight_1"], ["output_1"]),
+        ],
+        "graph",
+        [onnx.helper.make_tensor_value_info("input", onnx.TensorProto.FLOAT, [2, 64])],
+        [
+            onnx.helper.make_tensor_value_info("output_0", onnx.TensorProto.FLOAT, [2, 32]),
+            onnx.helper.make_tensor_value_info("output_1", onnx.TensorProto.FLOAT, [2, 48]),
+        ],
+        initializer=[
+            onnx.numpy_helper.from_array(rng.standard_normal((64, 32), dtype=np.float32), name="weight_0"),
+            onnx.numpy_helper.from_array(rng.standard_normal((64, 48), dtype=np.float32), name="weight_1"),
+        ],
+    )
+    model_path = tmp_path / "input" / "model.onnx"
+    model_path.parent.mkdir()
+    onnx.save(
+        onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 17)]),
+        model_path,
+        save_as_external_data=True,
+        location="weights.data",
+    )
+    run_config = {
+        "op_types_to_quantize": ["MatMul"],
+        "weight_type": QuantType.QInt8,
+        "nodes_to_quantize": None,
+        "nodes_to_exclude": None,
+        "per_channel": per_channel,
+        "reduce_range": reduce_range,
+        "extra_options": {"MatMulConstBOnly": True, "WeightSymmetric": True},
+    }
+
+    fast_model_path = tmp_path / "fast" / "model.onnx"
+    fast_model_path.parent.mkdir()
+    assert _quantize_dynamic_matmul_int8(str(model_path), str(fast_model_path), run_config)
+    ort_model_path = tmp_path / "ort" / "model.onnx"
+    ort_model_path.parent.mkdir()
+    quantize_dynamic(str(model_path), str(ort_model_path), use_external_data_format=True, **run_config)
+
+    # same model metadata, graph and weights as quantize_dynamic
+    fast_model = onnx.load(fast_model_path)
+    ort_model = onnx.load(ort_model_path)
+    assert (fast_model.producer_name, fast_model.producer_version) == (
+        ort_model.producer_name,
+        ort_model.producer_version,
+    )
+    assert fast_model.metadata_props == ort_model.metadata_props
+    assert fast_model.opset_import == ort_model.opset_import
+    assert sorted(
+        (node.op_type, node.name, list(node.input), list(node.output)) for node in fast_model.graph.node
+    ) == sorted((node.op_type, node.name, list(node.input), list(node.output)) for node in ort_model.graph.node)
+    fast_initializers = {i.name: onnx.numpy_helper.to_array(i) for i in fast_model.graph.initializer}
+    ort_initializers = {i.name: onnx.numpy_helper.to_array(i) for i in ort_model.graph.initializer}
+    assert fast_initializers.keys() == ort_initializers.keys()
+    for name, value in fast_initializers.items():
+        assert value.dtype == ort_initializers[name].dtype
+        assert np.array_equal(value, ort_initializers[name])
+
+
+def test_quantize_dynamic_matmul_int8_unsupported(tmp_path):
+    model_path = tmp_path / "model.onnx"
+    onnx.save(get_matmul_model(), model_path)
+    run_config = {
+        # other quantizable ops are only handled by quantize_dynamic
+        "op_types_to_quantize": None,
+        "weight_type": QuantType.QInt8,
+        "nodes_to_quantize": None,
+        "nodes_to_exclude": None,
+        "per_channel": False,
+        "reduce_range": False,
+        "extra_options": {"MatMulConstBOnly": True, "WeightSymmetric": True},
+    }
+    assert not _quantize_dynamic_matmul_int8(str(model_path), str(tmp_path / "output.onnx"), run_config)
+    assert not (tmp_path / "output.onnx").exists()
+
+
+def test_hash_calibration_data():
+    data_hash = _hash_calibration_data(FixedCalibrationDataReader())
+    assert data_hash == _hash_calibration_data(FixedCalibrationDataReader())
+
+    data_reader = FixedCalibrationDataReader()
+    data_reader.data_iter = iter(np.linspace(-1, 0, 10, dtype=np.float32).reshape(10, 1, 1))
+    assert data_hash != _hash_calibration_data(data_reader)
+
+
+@pytest.mark.skipif(
+    not _ORT_SUPPORTS_CALIBRATION_CACHE, reason="calibration cache is not supported by this version of onnxruntime"
+)
+def test_quantization_calibration_cache_recreates_dataloader(tmp_path):
+    data_readers = []
+
+    def dataloader_func(data_dir, batch_size, *args, **kwargs):
+        data_readers.append(FixedCalibrationDataReader())
+        return data_readers[-1]
+
+    config = {"quant_mode": "static", "dataloader_func": dataloader_func, "quant_preprocess": False}
+    p = create_pass_from_dict(OnnxQuantization, config, disable_search=True)
+    out = p.run(get_onnx_model(), None, tmp_path)
+    assert Path(out.model_path).exists()
+    # one data reader is consumed by the hash, the other one is used for calibration
+    assert len(data_readers) == 2
+    assert all(data_reader.get_next() is None for data_reader in data_readers)
+
+
+@pytest.mark.skipif(
+    not _ORT_SUPPORTS_CALIBRATION_CACHE, reason="calibration cache is not supported by this version of onnxruntime"
+)
+def test_quantization_calibration_data_failure(tmp_path):
+    config = {"quant_mode": "static", "dataloader_func": lambda data_dir, batch_size: None}
+    p = create_pass_from_dict(OnnxQuantization, config, disable_search=True)
+    with pytest.raises(OlivePassError, match="Failed to read the calibration data"):
+        p.run(get_onnx_model(), None, tmp_path)
+
+
+@pytest.mark.skipif(
+    not _ORT_SUPPORTS_CALIBRATION_CACHE, reason="calibration cache is not supported by this version of onnxruntime"
+)
+@pytest.mark.parametrize("smooth_quant", [True, False])
+def test_quantization_calibration_cache_key_reduce_range(smooth_quant, tmp_path):
+    calibration_cache_paths = []
+    for reduce_range in (True, False):
+        config = {
+            "quant_mode": "static",
+            "dataloader_func": fixed_dataloader_func,
+            "quant_preprocess": False,
+            "reduce_range": reduce_range,
+            "extra_options": {"SmoothQuant": smooth_quant},
+        }
+        p = create_pass_from_dict(OnnxQuantization, config, disable_search=True)
+        with patch("olive.passes.onnx.quantization._quantize_one") as mock_quantize_one, patch(
+            "olive.passes.onnx.quantization._move_onnx_model"
+        ):
+            p.run(get_onnx_model(), None, tmp_path / str(reduce_range))
+        calibration_cache_paths.append(mock_quantize_one.call_args.args[2]["calibration_cache_path"])
+    # smooth quant calibrates the model transformed with reduce_range
+    assert (calibration_cache_paths[0] != calibration_cache_paths[1]) == smooth_quant
+
+
+@pytest.mark.parametrize("calib_prefetch", [0, 2])
+def test_quantization_calib_prefetch(calib_prefetch, tmp_path):
+    config = {
+        "quant_mode": "static",
+        "dataloader_func": fixed_dataloader_func,
+        "calib_prefetch": calib_prefetch,
+    }
+    p = create_pass_from_dict(OnnxQuantization, config, disable_search=True)
+    with patch.object(
+        _PrefetchingCalibrationDataReader,
+        "close",
+        autospec=True,
+        side_effect=_PrefetchingCalibrationDataReader.close,
+    ) as mock_close:
+        out = p.run(get_onnx_model(), None, tmp_path)
+    assert Path(out.model_path).exists()
+    # the prefetching data reader is also used with the calibration cache and always stopped
+    assert mock_close.called == (calib_prefetch > 0)
+
+
+def test_prefetching_calibration_data_reader():
+    data_reader = _PrefetchingCalibrationDataReader(FixedCalibrationDataReader(), 2)
+    # nothing is read before the first batch is requested
+    assert data_reader.thread is None
+    expected = np.linspace(-1, 1, 10, dtype=np.float32).reshape(10, 1, 1)
+    assert np.array_equal([batch["input"] for batch in data_reader], expected)
+    assert data_reader.get_next() is None
+    data_reader.close()
+
+    class FailingCalibrationDataReader(CalibrationDataReader):
+        def get_next(self):
+            raise ValueError("failed to load batch")
+
+    data_reader = _PrefetchingCalibrationDataReader(FailingCalibrationDataReader(), 2)
+    with pytest.raises(ValueError, match="failed to load batch"):
+        data_reader.get_next()
+    data_reader.close()
+
+    class InfiniteCalibrationDataReader(CalibrationDataReader):
+        def get_next(self):
+            return {"input": np.zeros((1, 1), dtype=np.float32)}
+
+    # the background thread is blocked on the full queue when the consumer stops getting batches
+    data_reader = _PrefetchingCalibrationDataReader(InfiniteCalibrationDataReader(), 2)
+    data_reader.get_next()
+    data_reader.close()
+    assert not data_reader.thread.is_alive()
+
+
+@pytest.mark.parametrize("has_int16", [True, False])
+def test_qnn_static_quantization_int16_search_space(has_int16):
+    OnnxStaticQuantization._build_default_config.cache_clear()
+    with patch("olive.passes.onnx.quantization._ORT_HAS_INT16", has_int16):
+        config = OnnxStaticQuantization._build_default_config("QNNExecutionProvider")
+    OnnxStaticQuantization._build_default_config.cache_clear()
+    assert ("QInt16" in config["weight_type"].searchable_values.get_support()) == has_int16
+
+
+@pytest.mark.parametrize("skip_preprocess_if_shaped", [True, False])
+def test_skip_preprocess_if_shaped(skip_preprocess_if_shaped, tmp_path):
+    model = get_matmul_model()
+    model.graph.node[0].output[0] = "intermediate"
+    model.graph.node.append(onnx.helper.make_node("MatMul", ["intermediate", "weight"], ["output"], name="MatMul_1"))
+    input_model_path = tmp_path / "input" / "model.onnx"
+    input_model_path.parent.mkdir()
+    onnx.save(model, input_model_path)
+    assert not _has_complete_value_info(input_model_path)
+    onnx.save(onnx.shape_inference.infer_shapes(model), input_model_path)
+    assert _has_complete_value_info(input_model_path)
+
+    config = {"quant_preprocess": True, "skip_preprocess_if_shaped": skip_preprocess_if_shaped}
+    p = create_pass_from_dict(OnnxDynamicQuantization, config, disable_search=True)
+    with patch.object(OnnxDynamicQuantization, "_quant_preprocess", autospec=True) as mock_preprocess:
+        # same as preprocessing that fails and uses the original model
+        mock_preprocess.side_effect = shutil.copy
+        out = p.run(ONNXModelHandler(model_path=str(input_model_path)), None, tmp_path / "output")
+    assert Path(out.model_path).exists()
+    assert mock_preprocess.called != skip_preprocess_if_shaped
+
+
+class MatMulCalibrationDataReader(CalibrationDataReader):
+    def __init__(self):
+        super().__init__()
+        self.data_iter = iter(np.linspace(-1, 1, 4 * 64, dtype=np.float32).reshape(4, 1, 64))
+
+    def get_next(self) -> dict:
+        data = next(self.data_iter, None)
+        return None if data is None else {"input": data}
+
+
+def matmul_dataloader_func(data_dir, batch_size, *args, **kwargs):
+    return MatMulCalibrationDataReader()
+
+
+def test_preprocessed_model_shared_by_quantization_passes(tmp_path):
+    model = get_matmul_model()
+    # static quantization runs the model for calibration
+    model.ir_version = 8
+    input_model_path = tmp_path / "input" / "model.onnx"
+    input_model_path.parent.mkdir()
+    onnx.save(model, input_model_path)
+    input_model = ONNXModelHandler(model_path=str(input_model_path))
+
+    passes = [
+        create_pass_from_dict(OnnxDynamicQuantization, {"skip_preprocess_if_shaped": False}, disable_search=True),
+        create_pass_from_dict(
+            OnnxStaticQuantization,
+            {"skip_preprocess_if_shaped": False, "dataloader_func": matmul_dataloader_func},
+            disable_search=True,
+        ),
+    ]
+    with patch.object(OnnxQuantization, "_quant_preprocess", autospec=True) as mock_preprocess:
+        mock_preprocess.side_effect = shutil.copy
+        for i, p in enumerate(passes):
+            out = p.run(input_model, None, tmp_path / f"output_{i}")
+            assert Path(out.model_path).exists()
+    # the model is only preprocessed once
+    assert mock_preprocess.call_count == 1
+    assert (_get_quant_cache_dir() / _hash_onnx_model(input_model_path) / "preprocessed.onnx").exists()
+
+
+def test_failed_preprocessing_removes_staging_dir(tmp_path):
+    model = get_matmul_model()
+    input_model_path = tmp_path / "model.onnx"
+    onnx.save(model, input_model_path)
+    content_hash = _hash_onnx_model(input_model_path)
+
+    def failing_preprocess(model_path, output_model_path):
+        # leave a partially written model behind
+        Path(output_model_path).write_bytes(b"partial")
+        raise RuntimeError("interrupted")
+
+    with patch.object(OnnxQuantization, "_quant_preprocess", side_effect=failing_preprocess), pytest.raises(
+        RuntimeError, match="interrupted"
+    ):
+        OnnxQuantization._get_or_preprocess(content_hash, input_model_path)
+    assert not list(_get_quant_cache_dir().glob(f"{content_hash}*"))
+
+
+@patch("olive.passes.onnx.quantization.quantize_dynamic")
+@patch("olive.passes.onnx.quantization.quantize_static")
+def test_quantize_one_static_without_data_reader(mock_quantize_static, mock_quantize_dynamic, tmp_path):
+    # the calibration data reader can be None if the calibration ranges are cached
+    _quantize_one("model.onnx", str(tmp_path / "model.onnx"), {"calibration_cache_path": "calib.json"}, True)
+    assert mock_quantize_static.call_args.kwargs["calibration_data_reader"] is None
+    mock_quantize_dynamic.assert_not_called()
+
+
+@patch("olive.passes.onnx.quantization._PREPROCESSED_MODEL_CACHE_SIZE", 2)
+def test_preprocessed_model_cache_evicts_least_recently_used(tmp_path):
+    input_model_path = tmp_path / "model.onnx"
+    onnx.save(get_matmul_model(), input_model_path)
+
+    with patch.object(OnnxQuantization, "_quant_preprocess", side_effect=shutil.copy) as mock_preprocess:
+        for content_hash in ("model_0", "model_1", "model_0", "model_2"):
+            OnnxQuantization._get_or_preprocess(content_hash, input_model_path)
+    assert mock_preprocess.call_count == 3
+    # model_1 is the least recently used one when model_2 is preprocessed
+    assert sorted(path.name for path in _get_quant_cache_dir().iterdir()) == ["model_0", "model_2"]